@@ -0,0 +1,263 @@
+"""
+Per-day drop/pump/range rollup of the Binance spot 1d tables, kept as one
+materialized view in the Binance DB, and the loaders shared by
+oct_10th_stats.py and volatility_binance_2017_2025.py.
+
+- get_spot_1d_tables: the table set both scripts (and the view) use
+- ensure_daily_rollup: build / refresh the view, skipping unreadable
+  tables, and warn when it is older than the newest candle
+- read_rollup: rows from the view
+- read_tables: per-candle stats from the Parquet cache or the raw tables,
+  for when the view is off or can't be built
+"""
+
+import tempfile
+
+import pandas as pd
+
+import ohlcv_cache
+from pg_helpers import copy_to_file, quote_ident, quote_literal
+
+
+ROLLUP_VIEW = "daily_market_stats"
+
+TABLE_PATTERN = "binance\\_%\\_1d"
+
+TIME_COL = "timestamp"
+OPEN_COL = "open"
+HIGH_COL = "high"
+LOW_COL  = "low"
+
+# Rows parsed per batch from the COPY spool file
+STREAM_ITERSIZE = 50000
+
+
+def get_spot_1d_tables(conn):
+    """
+    Binance spot 1d tables: futures (containing ':') and malformed names
+    (spaces/dots) are skipped.
+    """
+    q = """
+        SELECT tablename
+        FROM pg_tables
+        WHERE schemaname='public'
+          AND tablename LIKE %s;
+    """
+    with conn.cursor() as cur:
+        cur.execute(q, (TABLE_PATTERN,))
+        rows = cur.fetchall()
+
+    out = []
+    for (tbl,) in rows:
+        if ":" in tbl:
+            continue  # skip futures
+        if " " in tbl or "." in tbl:
+            continue  # skip malformed names
+        out.append(tbl)
+
+    return out
+
+
+def build_rollup_query(tables):
+    """
+    One row per (table, day) with drop/pump/range % precomputed.
+    is_valid is the open/high/low > 0 filter used by oct_10th_stats.py.
+    """
+    parts = []
+    for tbl in tables:
+        o = f"{OPEN_COL}::double precision"
+        h = f"{HIGH_COL}::double precision"
+        l = f"{LOW_COL}::double precision"
+        parts.append(f"""
+            SELECT
+                {quote_literal(tbl)}::text AS tablename,
+                (to_timestamp({TIME_COL} / 1000.0) AT TIME ZONE 'UTC')::date AS day,
+                ({o} - {l}) / NULLIF({o}, 0) * 100.0 AS drop_pct,
+                ({h} - {l}) / NULLIF({l}, 0) * 100.0 AS pump_pct,
+                ({h} - {l}) / NULLIF({o}, 0) * 100.0 AS range_pct,
+                ({o} > 0 AND {h} > 0 AND {l} > 0) AS is_valid
+            FROM {quote_ident(tbl)}
+        """)
+    return "\nUNION ALL\n".join(parts)
+
+
+def readable_tables(conn, tables):
+    """
+    The tables whose rollup SELECT runs, each tried under a savepoint; the
+    others are reported and left out. A full scan per table, so only used
+    once building over every table at once has failed.
+    """
+    ok = []
+    with conn.cursor() as cur:
+        for tbl in tables:
+            cur.execute("SAVEPOINT rollup_probe")
+            try:
+                cur.execute(f"SELECT count(s) FROM ({build_rollup_query([tbl])}) AS s;")
+                cur.execute("RELEASE SAVEPOINT rollup_probe")
+                ok.append(tbl)
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT rollup_probe")
+                cur.execute("RELEASE SAVEPOINT rollup_probe")
+                print(f"Skipping {tbl} due to error: {e}")
+    return ok
+
+
+def create_rollup(conn, tables):
+    """
+    CREATE the view over `tables`; if one of them breaks the statement,
+    retry over the ones that can be read.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SAVEPOINT rollup_build")
+        try:
+            cur.execute(f"CREATE MATERIALIZED VIEW {ROLLUP_VIEW} AS {build_rollup_query(tables)};")
+            cur.execute("RELEASE SAVEPOINT rollup_build")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT rollup_build")
+            cur.execute("RELEASE SAVEPOINT rollup_build")
+            print(f"Building {ROLLUP_VIEW} failed ({e}); checking tables one by one...")
+
+            tables = readable_tables(conn, tables)
+            if not tables:
+                raise RuntimeError("no readable tables")
+            cur.execute(f"CREATE MATERIALIZED VIEW {ROLLUP_VIEW} AS {build_rollup_query(tables)};")
+
+        cur.execute(f"CREATE INDEX ON {ROLLUP_VIEW} (day);")
+
+
+def warn_if_stale(conn, tables):
+    """
+    Print a warning when the newest candle in `tables` is on a later day
+    than the newest day in the view.
+    """
+    newest = "\nUNION ALL\n".join(
+        f"SELECT max({TIME_COL}) AS ts FROM {quote_ident(t)}" for t in tables
+    )
+    q = f"""
+        SELECT
+            (SELECT max(day) FROM {ROLLUP_VIEW}),
+            (to_timestamp(max(ts) / 1000.0) AT TIME ZONE 'UTC')::date
+        FROM ({newest}) AS s;
+    """
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(q)
+            view_day, candle_day = cur.fetchone()
+    except Exception as e:
+        conn.rollback()
+        print(f"Could not check how current {ROLLUP_VIEW} is: {e}")
+        return
+
+    if candle_day is not None and (view_day is None or candle_day > view_day):
+        print(
+            f"WARNING: {ROLLUP_VIEW} ends on {view_day} but the newest candle is "
+            f"from {candle_day}. Set REFRESH_ROLLUP = True to refresh it "
+            f"(or drop the view to also pick up new tables)."
+        )
+
+
+def ensure_daily_rollup(conn, refresh=False):
+    """
+    Create ROLLUP_VIEW over get_spot_1d_tables if it doesn't exist yet, or
+    refresh it when `refresh` is set; then warn if it is out of date.
+    Returns True when the view is ready to query, False when it could not
+    be built or refreshed (callers then read the tables instead).
+    """
+    tables = get_spot_1d_tables(conn)
+    if not tables:
+        print(f"No tables matching {TABLE_PATTERN}; not building {ROLLUP_VIEW}.")
+        return False
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s);", (ROLLUP_VIEW,))
+        (exists,) = cur.fetchone()
+
+    try:
+        if exists is None:
+            print(f"Building {ROLLUP_VIEW} (one-time full scan)...")
+            create_rollup(conn, tables)
+        elif refresh:
+            print(f"Refreshing {ROLLUP_VIEW}...")
+            with conn.cursor() as cur:
+                cur.execute(f"REFRESH MATERIALIZED VIEW {ROLLUP_VIEW};")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Could not build {ROLLUP_VIEW}: {e}")
+        return False
+
+    if exists is not None and not refresh:
+        warn_if_stale(conn, tables)
+
+    return True
+
+
+def read_rollup(conn, select, where, columns, refresh=False):
+    """
+    SELECT `select` FROM ROLLUP_VIEW WHERE `where`, as a DataFrame with
+    `columns` (the first one must be day). None if the view can't be built
+    or refreshed.
+    """
+    if not ensure_daily_rollup(conn, refresh=refresh):
+        return None
+
+    q = f"""
+        SELECT {select}
+        FROM {ROLLUP_VIEW}
+        WHERE {where}
+    """
+
+    with tempfile.TemporaryFile() as buf:
+        if not copy_to_file(conn, q, buf):
+            return pd.DataFrame(columns=columns)
+
+        return pd.read_csv(buf, header=None, names=columns, parse_dates=["day"])
+
+
+def scan_tables(conn, tables, raw_columns, transform):
+    """
+    Read `raw_columns` of every table straight from Postgres, yielding
+    transform(chunk) frames (None results dropped).
+    Tables that fail to read are reported and skipped.
+    """
+    for tbl in tables:
+        q = f"SELECT {', '.join(raw_columns)} FROM {quote_ident(tbl)}"
+
+        # Spool the COPY output to disk and parse it back in batches, so
+        # memory stays bounded on the big tables.
+        try:
+            with tempfile.TemporaryFile() as buf:
+                if not copy_to_file(conn, q, buf):
+                    continue
+
+                frames = []
+                for chunk in pd.read_csv(buf, header=None, chunksize=STREAM_ITERSIZE):
+                    stats = transform(chunk)
+                    if stats is not None:
+                        frames.append(stats)
+        except Exception as e:
+            conn.rollback()
+            print(f"Skipping {tbl} due to error: {e}")
+            continue
+
+        yield from frames
+
+
+def read_tables(conn, tables, raw_columns, transform, columns, use_cache=True):
+    """
+    Concatenated transform(...) frames over the raw `raw_columns` of every
+    table (first column the integer timestamp): from the local Parquet cache
+    when use_cache is set and pyarrow is available, otherwise straight from
+    Postgres. An empty DataFrame with `columns` if nothing comes back.
+    """
+    if use_cache and ohlcv_cache.HAVE_PYARROW:
+        raw = ohlcv_cache.load_ohlc_many(conn, tables, raw_columns).values()
+        frames = [f for f in map(transform, raw) if f is not None]
+    else:
+        frames = list(scan_tables(conn, tables, raw_columns, transform))
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(frames, ignore_index=True)
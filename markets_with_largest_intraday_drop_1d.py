@@ -1,6 +1,28 @@
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xlsxwriter
+    HAVE_XLSXWRITER = True
+except ImportError:
+    HAVE_XLSXWRITER = False
+
+try:
+    import pyarrow  # noqa: F401
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+from pg_helpers import (
+    ensure_timestamp_indexes,
+    quote_ident,
+    quote_literal,
+    register_numeric_as_float,
+)
+from time_bounds import build_time_bounds
 
 # ==========================
 # CONFIG
@@ -27,36 +49,31 @@ TIME_COL = "timestamp"   # Unix timestamp in ms
 HIGH_COL = "high"
 LOW_COL  = "low"
 
+# How many tables to fold into one UNION ALL statement
+STATS_CHUNK_SIZE = 500
+
+# Parallel query workers (one pooled connection each)
+MAX_WORKERS = 16
+
+# Build a btree index on TIME_COL for any table missing one (one-off cost)
+ENSURE_TS_INDEXES = True
+
 # Output Excel file
 OUTPUT_XLSX = "binance_oct10_drops.xlsx"
 
+# Also write a Parquet copy for downstream analysis (needs pyarrow)
+OUTPUT_PARQUET = "binance_oct10_drops.parquet"
+
 
 # ==========================
 # HELPERS
 # ==========================
 
-def build_time_bounds(start_str, end_str, unit):
-    """
-    Convert human-readable datetime strings to numeric Unix timestamps
-    in the specified unit ("s" or "ms").
-    Returns (start_ts, end_ts).
-    """
-    def to_epoch(s):
-        if s is None:
-            return None
-        dt = pd.to_datetime(s)
-        ts = dt.timestamp()  # seconds
-        if unit == "ms":
-            ts *= 1000.0
-        return int(ts)
-
-    return to_epoch(start_str), to_epoch(end_str)
-
-
 # Use ms because your timestamps are in milliseconds.
+# Half-open window: [TARGET_DATE 00:00, next day 00:00)
 START_TS, END_TS = build_time_bounds(
     f"{TARGET_DATE} 00:00:00",
-    f"{TARGET_DATE} 23:59:59",
+    str(pd.Timestamp(TARGET_DATE) + pd.Timedelta(days=1)),
     unit="ms",
 )
 
@@ -78,32 +95,57 @@ def get_binance_tables(conn):
     return [r[0] for r in rows]
 
 
-def get_daily_stats_for_table(conn, table_name, start_ts, end_ts):
+def get_daily_stats_chunk(pool, tables, start_ts, end_ts):
     """
-    For tables with unix integer timestamps (ms).
+    Run one UNION ALL statement covering every table in `tables` on a
+    connection checked out from the pool.
+    Returns a list of (tablename, n_rows, day_high, day_low) tuples;
+    tables with no candles in the window produce no row at all.
     """
-    query = f"""
+    query = "\nUNION ALL\n".join(
+        f"""
         SELECT
+            {quote_literal(t)} AS tablename,
             COUNT(*) AS n_rows,
             MAX({HIGH_COL}) AS day_high,
             MIN({LOW_COL})  AS day_low
-        FROM {table_name}
-        WHERE {TIME_COL} >= %s
-          AND {TIME_COL} <= %s;
-    """
+        FROM {quote_ident(t)}
+        WHERE {TIME_COL} >= %(start_ts)s
+          AND {TIME_COL} < %(end_ts)s
+        HAVING COUNT(*) > 0
+        """
+        for t in tables
+    )
+    params = {"start_ts": start_ts, "end_ts": end_ts}
+
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
+    finally:
+        pool.putconn(conn)
 
-    with conn.cursor() as cur:
-        cur.execute(query, (start_ts, end_ts))
-        n_rows, day_high, day_low = cur.fetchone()
 
-    if n_rows == 0 or day_high is None or day_low is None:
-        return None
+def get_daily_stats_bulk(pool, tables, start_ts, end_ts):
+    """
+    For tables with unix integer timestamps (ms).
+
+    Instead of one round trip per table, fold up to STATS_CHUNK_SIZE tables
+    into a single UNION ALL query, and run the chunks concurrently across
+    the connection pool.
+    """
+    chunks = [
+        tables[i:i + STATS_CHUNK_SIZE]
+        for i in range(0, len(tables), STATS_CHUNK_SIZE)
+    ]
 
-    return {
-        "n_rows": n_rows,
-        "day_high": float(day_high),
-        "day_low": float(day_low),
-    }
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(
+            lambda chunk: get_daily_stats_chunk(pool, chunk, start_ts, end_ts),
+            chunks,
+        )
+        return [row for rows in results for row in rows]
 
 
 def parse_market_from_table_name(table_name):
@@ -128,70 +170,93 @@ def parse_market_from_table_name(table_name):
     return exchange, market, timeframe
 
 
+def write_xlsx_streaming(df, path):
+    """
+    Write df with xlsxwriter in constant_memory mode, which flushes each
+    row to disk as soon as the next one starts instead of keeping the whole
+    workbook in memory.
+
+    Rows are written directly: pandas' to_excel fills the sheet column by
+    column, which constant_memory mode can't handle.
+    """
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True, "nan_inf_to_errors": True})
+    ws = wb.add_worksheet()
+
+    ws.write_row(0, 0, list(df.columns))
+    for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        ws.write_row(i, 0, row)
+
+    wb.close()
+
+
 # ==========================
 # MAIN LOGIC
 # ==========================
 
 def main():
-    conn = psycopg2.connect(**DB_CONFIG)
+    register_numeric_as_float()
+
+    pool = psycopg2.pool.ThreadedConnectionPool(
+        minconn=4, maxconn=MAX_WORKERS, **DB_CONFIG
+    )
 
     try:
         print("Fetching binance tables...")
-        tables = get_binance_tables(conn)
+        conn = pool.getconn()
+        try:
+            tables = get_binance_tables(conn)
+        finally:
+            pool.putconn(conn)
         print(f"Found {len(tables)} tables.")
 
-        results = []
-
-        for tbl in tables:
-
-    # Skip futures tables (colon in table name)
-            if ":" in tbl:
-                continue
-        
-            stats = get_daily_stats_for_table(conn, tbl, START_TS, END_TS)
-            if stats is None:
-                continue
-        
-            day_high = stats["day_high"]
-            day_low = stats["day_low"]
-        
-            # Avoid division by zero
-            if day_high == 0:
-                continue
-        
-            # Intraday drop magnitude (positive %)
-            drop_pct = (day_high - day_low) / day_high * 100.0
-        
-            exchange, market, timeframe = parse_market_from_table_name(tbl)
-        
-            results.append({
-                "table_name": tbl,
-                "exchange": exchange,
-                "market": market,
-                "timeframe": timeframe,
-                "n_candles_on_day": stats["n_rows"],
-                "day_high": day_high,
-                "day_low": day_low,
-                "intraday_drop_pct": drop_pct,
-            })
-
-
-        if not results:
+        # Skip futures tables (colon in table name)
+        tables = [t for t in tables if ":" not in t]
+
+        if ENSURE_TS_INDEXES:
+            conn = pool.getconn()
+            try:
+                ensure_timestamp_indexes(conn, tables, TIME_COL)
+            finally:
+                pool.putconn(conn)
+
+        stats = get_daily_stats_bulk(pool, tables, START_TS, END_TS)
+
+        df = pd.DataFrame(stats, columns=["table_name", "n_candles_on_day", "day_high", "day_low"])
+        df = df.dropna(subset=["day_high", "day_low"])
+
+        # Avoid division by zero
+        df = df[df["day_high"] != 0]
+
+        if df.empty:
             print("No data found for the given date. Check timestamps / date.")
             return
 
-        # Build DataFrame
-        df = pd.DataFrame(results)
+        # Intraday drop magnitude (positive %)
+        day_high = df["day_high"].to_numpy()
+        day_low = df["day_low"].to_numpy()
+        df["intraday_drop_pct"] = (day_high - day_low) / day_high * 100.0
+
+        parsed = [parse_market_from_table_name(t) for t in df["table_name"]]
+        df.insert(1, "exchange", [p[0] for p in parsed])
+        df.insert(2, "market", [p[1] for p in parsed])
+        df.insert(3, "timeframe", [p[2] for p in parsed])
 
         # Sort by biggest drop first
         df.sort_values(by="intraday_drop_pct", ascending=False, inplace=True)
 
         # Save to Excel
-        df.to_excel(OUTPUT_XLSX, index=False)
+        if HAVE_XLSXWRITER:
+            write_xlsx_streaming(df, OUTPUT_XLSX)
+        else:
+            df.to_excel(OUTPUT_XLSX, index=False)
         print(f"Done. Wrote results to {OUTPUT_XLSX}")
 
+        if OUTPUT_PARQUET and HAVE_PYARROW:
+            df.to_parquet(OUTPUT_PARQUET, index=False, compression="zstd")
+            print(f"Wrote {OUTPUT_PARQUET}")
+
     finally:
-        conn.close()
+        pool.closeall()
 
 
 if __name__ == "__main__":
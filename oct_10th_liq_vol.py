@@ -1,6 +1,16 @@
 import psycopg2
+import psycopg2.pool
 import pandas as pd
-import re
+from concurrent.futures import ThreadPoolExecutor
+
+from pg_helpers import (
+    ensure_timestamp_indexes,
+    quote_ident,
+    quote_literal,
+    register_numeric_as_float,
+    run_chunked,
+)
+from time_bounds import build_time_bounds
 
 # ==========================================================
 # CONFIG
@@ -35,24 +45,45 @@ LOW_COL    = "low"
 VOLUME_COL = "volume"
 
 # Only count these quote assets, treat all as USD
-USD_QUOTES = {"usd", "usdt", "usdc", "eur"}
+USD_QUOTES = frozenset({"usd", "usdt", "usdc", "eur"})
+
+# Quote alternation for the table-name regexes (longest first)
+USD_QUOTE_ALT = "|".join(sorted(USD_QUOTES, key=lambda q: (-len(q), q)))
+
+# Table-name regexes (Postgres ~ operator), built once.
+# For Gate specifically, we enforce strict patterns so we don't ingest
+# weird stuff like 'gate_game.com_usdt_1m' or 'gate_bitcoin file_usdt_1m'.
+GATE_TABLE_RE  = rf"^gate_[a-z0-9]+_({USD_QUOTE_ALT})(:\1)?_1m$"
+OTHER_TABLE_RE = rf"^{{ex}}_[^_ .:]+_({USD_QUOTE_ALT})([:_][^ .]*)?_1m$"
 
 OUTPUT_CSV = "all_exchanges_liq_window_volume_spot_futures.csv"
 
+# Build a btree index on TIME_COL for any table missing one (one-off cost)
+ENSURE_TS_INDEXES = True
+
+# Parallel query workers per exchange (one pooled connection each)
+MAX_WORKERS = 16
+
+# Exchanges processed at once; keep EXCHANGE_WORKERS * MAX_WORKERS under
+# the server's max_connections
+EXCHANGE_WORKERS = 4
+
+# How many tables to fold into one UNION ALL statement
+VOLUME_CHUNK_SIZE = 500
+
 
 # ==========================================================
 # HELPERS
 # ==========================================================
 
-def build_time_bounds(start_str, end_str, unit="ms"):
-    def to_epoch(s):
-        dt = pd.to_datetime(s)
-        ts = dt.timestamp()  # seconds
-        if unit == "ms":
-            ts *= 1000
-        return int(ts)
-
-    return to_epoch(start_str), to_epoch(end_str)
+def table_name_regex(ex_lower):
+    """
+    POSIX regex (Postgres ~ operator) for the 1m tables we want from one
+    exchange: USD-like quotes only, no spaces or dots in the name.
+    """
+    if ex_lower == "gate":
+        return GATE_TABLE_RE
+    return OTHER_TABLE_RE.format(ex=ex_lower)
 
 
 def get_spot_and_futures_tables(conn, exchange):
@@ -64,52 +95,27 @@ def get_spot_and_futures_tables(conn, exchange):
     Spot tables:    exchange_base_quote_1m
     Futures tables: exchange_base_quote:quote_1m  (contain colon)
 
-    For Gate specifically, we enforce strict patterns so we don't ingest
-    weird stuff like 'gate_game.com_usdt_1m' or 'gate_bitcoin file_usdt_1m'.
+    Name filtering happens server-side (see table_name_regex); here we only
+    split the result into spot and futures.
     """
-    ex_lower = exchange.lower()
-    pattern = f"{ex_lower}\\_%\\_1m"
-
     query = """
         SELECT tablename
         FROM pg_tables
         WHERE schemaname='public'
-          AND tablename LIKE %s;
+          AND tablename ~ %s;
     """
 
     with conn.cursor() as cur:
-        cur.execute(query, (pattern,))
+        cur.execute(query, (table_name_regex(exchange.lower()),))
         rows = cur.fetchall()
 
     spot, fut = [], []
 
-    # Strict patterns for Gate
-    gate_spot_re = re.compile(r"^gate_[a-z0-9]+_(usdt|usdc|usd|eur)_1m$")
-    gate_fut_re  = re.compile(r"^gate_[a-z0-9]+_(usdt|usdc|usd|eur):\1_1m$")
-
     for (name,) in rows:
-        # Skip names with spaces or dots everywhere
-        if " " in name or "." in name:
-            continue
-
-        if ex_lower == "gate":
-            # Gate: enforce strict patterns
-            if ":" in name:
-                # futures
-                if not gate_fut_re.match(name):
-                    continue
-                fut.append(name)
-            else:
-                # spot
-                if not gate_spot_re.match(name):
-                    continue
-                spot.append(name)
+        if ":" in name:
+            fut.append(name)
         else:
-            # Non-Gate: simpler rules
-            if ":" in name:
-                fut.append(name)
-            else:
-                spot.append(name)
+            spot.append(name)
 
     return spot, fut
 
@@ -132,46 +138,132 @@ def parse_market(table):
     return base, quote
 
 
-def quote_ident(name: str) -> str:
+def fetch_usd_volumes(conn, tables, start_ts, end_ts):
     """
-    Safely quote a Postgres identifier, even if it contains :, ., or caps.
+    Sum mid * volume over the liquidation window for each table, server-side,
+    in a single UNION ALL round trip.
+    Returns {table: usd_volume} for tables that have rows in the window.
     """
-    escaped = name.replace('"', '""')
-    return f'"{escaped}"'
+    query = "\nUNION ALL\n".join(
+        f"""
+        SELECT
+            {quote_literal(t)} AS tablename,
+            SUM((({HIGH_COL} + {LOW_COL}) / 2.0) * {VOLUME_COL}) AS usd_volume
+        FROM {quote_ident(t)}
+        WHERE {TIME_COL} >= %(start_ts)s
+          AND {TIME_COL} <= %(end_ts)s
+        """
+        for t in tables
+    )
+    params = {"start_ts": start_ts, "end_ts": end_ts}
+
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
 
+    return {t: v for t, v in rows if v is not None}
 
-def fetch_window(conn, table, start_ts, end_ts):
+
+def fetch_usd_volumes_pooled(pool, tables, start_ts, end_ts):
     """
-    Fetch all rows in the liquidation window for a given table.
-    Returns DataFrame with columns: timestamp, high, low, volume
+    Same as fetch_usd_volumes, but checks a connection out of the pool for
+    the duration of the query so it can run from a worker thread. Tables
+    that fail the query are reported and left out.
     """
-    tbl = quote_ident(table)
-
-    query = f"""
-        SELECT {TIME_COL}, {HIGH_COL}, {LOW_COL}, {VOLUME_COL}
-        FROM {tbl}
-        WHERE {TIME_COL} >= %s
-          AND {TIME_COL} <= %s;
+    conn = pool.getconn()
+    try:
+        out = {}
+        for part in run_chunked(
+            conn, tables, lambda chunk: fetch_usd_volumes(conn, chunk, start_ts, end_ts)
+        ):
+            out.update(part)
+        return out
+    finally:
+        pool.putconn(conn)
+
+
+def process_exchange(ex, start_ts, end_ts):
     """
+    Sum liquidation-window USD volume for every spot/futures market on one
+    exchange. Each exchange lives in its own database, so this is fully
+    independent of the others and safe to run from a worker thread.
 
-    with conn.cursor() as cur:
+    Returns (n_spot_tables, n_fut_tables, ex_totals, cols), where cols holds
+    one list per output column; None if the database can't be reached.
+    """
+    dbname = DB_TEMPLATE.format(ex)
+
+    try:
+        pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=1, maxconn=MAX_WORKERS, dbname=dbname, **DB_CONFIG
+        )
+    except Exception as e:
+        print(f"Could not connect to {dbname}: {e}")
+        return None
+
+    cols = {
+        "exchange": [],
+        "type": [],
+        "table": [],
+        "base": [],
+        "quote": [],
+        "usd_volume": [],
+    }
+    ex_totals = {"spot": 0.0, "futures": 0.0}
+
+    try:
+        conn = pool.getconn()
         try:
-            cur.execute(query, (start_ts, end_ts))
-        except psycopg2.errors.UndefinedTable:
-            print(f"  Skipping missing table: {table}")
-            return pd.DataFrame()
-        except Exception as e:
-            print(f"  ERROR querying {table}: {e}")
-            return pd.DataFrame()
+            spot_tables, fut_tables = get_spot_and_futures_tables(conn, ex)
+            if ENSURE_TS_INDEXES:
+                ensure_timestamp_indexes(conn, spot_tables + fut_tables, TIME_COL)
+        finally:
+            pool.putconn(conn)
 
-        rows = cur.fetchall()
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for kind, tables in (("spot", spot_tables), ("futures", fut_tables)):
+                markets = []
+                for tbl in tables:
+                    base, quote = parse_market(tbl)
+                    if base is None or quote is None:
+                        continue
+
+                    if quote not in USD_QUOTES:
+                        continue
+
+                    markets.append((tbl, base, quote))
+
+                names = [m[0] for m in markets]
+                chunks = [
+                    names[i:i + VOLUME_CHUNK_SIZE]
+                    for i in range(0, len(names), VOLUME_CHUNK_SIZE)
+                ]
+
+                volumes = {}
+                for part in executor.map(
+                    lambda chunk: fetch_usd_volumes_pooled(pool, chunk, start_ts, end_ts),
+                    chunks,
+                ):
+                    volumes.update(part)
+
+                for tbl, base, quote in markets:
+                    usd_sum = volumes.get(tbl)
+                    if usd_sum is None:
+                        continue
+
+                    ex_totals[kind] += usd_sum
+
+                    cols["exchange"].append(ex)
+                    cols["type"].append(kind)
+                    cols["table"].append(tbl)
+                    cols["base"].append(base)
+                    cols["quote"].append(quote)
+                    cols["usd_volume"].append(usd_sum)
 
-    if not rows:
-        return pd.DataFrame()
+    finally:
+        pool.closeall()
 
-    df = pd.DataFrame(rows, columns=[TIME_COL, HIGH_COL, LOW_COL, VOLUME_COL])
-    df = df.astype({HIGH_COL: float, LOW_COL: float, VOLUME_COL: float})
-    return df
+    return len(spot_tables), len(fut_tables), ex_totals, cols
 
 
 # ==========================================================
@@ -179,91 +271,42 @@ def fetch_window(conn, table, start_ts, end_ts):
 # ==========================================================
 
 def main():
+    register_numeric_as_float()
+
     start_ts, end_ts = build_time_bounds(START_TIME_STR, END_TIME_STR, unit=TS_UNIT)
     print(f"Window ts: {start_ts} -> {end_ts}")
 
     global_spot_total = 0.0
     global_fut_total = 0.0
 
-    master_rows = []
-
-    for ex in EXCHANGES:
-        dbname = DB_TEMPLATE.format(ex)
-        print(f"\n===== Processing {ex} ({dbname}) =====")
-
-        try:
-            conn = psycopg2.connect(dbname=dbname, **DB_CONFIG)
-        except Exception as e:
-            print(f"Could not connect to {dbname}: {e}")
-            continue
-
-        try:
-            spot_tables, fut_tables = get_spot_and_futures_tables(conn, ex)
-            print(f"{len(spot_tables)} spot tables, {len(fut_tables)} futures tables")
-
-            ex_spot_total = 0.0
-            ex_fut_total = 0.0
-
-            # -------------------------------
-            # SPOT
-            # -------------------------------
-            for tbl in spot_tables:
-                base, quote = parse_market(tbl)
-                if base is None or quote is None:
-                    continue
-
-                if quote not in USD_QUOTES:
-                    continue
-
-                df = fetch_window(conn, tbl, start_ts, end_ts)
-                if df.empty:
-                    continue
-
-                df["mid"] = (df[HIGH_COL] + df[LOW_COL]) / 2.0
-                df["usd_volume"] = df["mid"] * df[VOLUME_COL]
-
-                usd_sum = df["usd_volume"].sum()
-                ex_spot_total += usd_sum
-
-                master_rows.append({
-                    "exchange": ex,
-                    "type": "spot",
-                    "table": tbl,
-                    "base": base,
-                    "quote": quote,
-                    "usd_volume": usd_sum,
-                })
-
-            # -------------------------------
-            # FUTURES
-            # -------------------------------
-            for tbl in fut_tables:
-                base, quote = parse_market(tbl)
-                if base is None or quote is None:
-                    continue
-
-                if quote not in USD_QUOTES:
-                    continue
-
-                df = fetch_window(conn, tbl, start_ts, end_ts)
-                if df.empty:
-                    continue
-
-                df["mid"] = (df[HIGH_COL] + df[LOW_COL]) / 2.0
-                df["usd_volume"] = df["mid"] * df[VOLUME_COL]
-
-                usd_sum = df["usd_volume"].sum()
-                ex_fut_total += usd_sum
-
-                master_rows.append({
-                    "exchange": ex,
-                    "type": "futures",
-                    "table": tbl,
-                    "base": base,
-                    "quote": quote,
-                    "usd_volume": usd_sum,
-                })
-
+    # Per-market output, one list per column
+    master_cols = {
+        "exchange": [],
+        "type": [],
+        "table": [],
+        "base": [],
+        "quote": [],
+        "usd_volume": [],
+    }
+
+    # Exchanges are separate databases, so run several at once; results
+    # come back (and are reported) in EXCHANGES order.
+    with ThreadPoolExecutor(max_workers=EXCHANGE_WORKERS) as ex_executor:
+        results = ex_executor.map(
+            lambda ex: process_exchange(ex, start_ts, end_ts), EXCHANGES
+        )
+
+        for ex, result in zip(EXCHANGES, results):
+            print(f"\n===== {ex} ({DB_TEMPLATE.format(ex)}) =====")
+            if result is None:
+                print("Skipped (no connection)")
+                continue
+
+            n_spot, n_fut, ex_totals, cols = result
+            print(f"{n_spot} spot tables, {n_fut} futures tables")
+
+            ex_spot_total = ex_totals["spot"]
+            ex_fut_total = ex_totals["futures"]
             ex_combined = ex_spot_total + ex_fut_total
 
             print(f"Spot total    : {ex_spot_total:,.2f} USD")
@@ -273,12 +316,12 @@ def main():
             global_spot_total += ex_spot_total
             global_fut_total += ex_fut_total
 
-        finally:
-            conn.close()
+            for key, values in cols.items():
+                master_cols[key].extend(values)
 
     # Save detailed per-market rows
-    if master_rows:
-        df = pd.DataFrame(master_rows)
+    if master_cols["table"]:
+        df = pd.DataFrame(master_cols)
         df.to_csv(OUTPUT_CSV, index=False)
         print(f"\nWrote per-market CSV: {OUTPUT_CSV}")
 
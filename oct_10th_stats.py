@@ -2,6 +2,15 @@ import psycopg2
 import pandas as pd
 import numpy as np
 
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+import daily_rollup
+from time_bounds import epoch_to_days
+
 DB_CONFIG = {
     "host": "localhost",
     "port": 5432,
@@ -10,9 +19,8 @@ DB_CONFIG = {
 }
 
 DB_NAME = "Testing_Data_Collection_Binance"
-TABLE_PATTERN = "binance\\_%\\_1d"
 
-TARGET_DAY = pd.to_datetime("2025-10-10").date()
+TARGET_DAY = pd.Timestamp("2025-10-10")
 
 TIME_COL  = "timestamp"
 OPEN_COL  = "open"
@@ -22,79 +30,112 @@ CLOSE_COL = "close"
 
 OUT_CSV = "oct10_zscores_clean.csv"
 
+STATS_COLUMNS = ["day", "drop%", "pump%", "range%"]
 
-def quote_ident(name: str) -> str:
-    """Safely quote ANY Postgres identifier."""
-    escaped = name.replace('"', '""')
-    return f'"{escaped}"'
+# drop/pump/range% from the rollup view (daily_rollup.py), else Parquet cache, else the tables
+USE_DAILY_ROLLUP  = True
+REFRESH_ROLLUP    = False
+USE_PARQUET_CACHE = True
 
 
-def get_tables(conn):
-    q = """
-        SELECT tablename
-        FROM pg_tables
-        WHERE schemaname='public'
-          AND tablename LIKE %s;
+def candle_stats(data):
     """
-    with conn.cursor() as cur:
-        cur.execute(q, (TABLE_PATTERN,))
-        rows = cur.fetchall()
-
-    out = []
-    for (tbl,) in rows:
-        if ":" in tbl:
-            continue  # skip futures
-        if " " in tbl or "." in tbl:
-            continue  # skip malformed names
-        out.append(tbl)
-
-    return out
-
+    Turn raw (ts_ms, open, high, low) rows into a DataFrame of
+    day / drop% / pump% / range%, computed column-wise.
+    """
+    arr = np.asarray(data, dtype=np.float64)
+    if arr.size == 0:
+        return None
 
-def ts_to_day(ts_ms):
-    return pd.to_datetime(ts_ms, unit="ms", utc=True).date()
+    ts, o, h, l = arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3]
 
+    # NULLs come through as NaN and fail these comparisons too
+    mask = (o > 0) & (h > 0) & (l > 0)
+    ts, o, h, l = ts[mask], o[mask], h[mask], l[mask]
 
-def main():
-    conn = psycopg2.connect(dbname=DB_NAME, **DB_CONFIG)
-    tables = get_tables(conn)
-
-    print(f"Processing {len(tables)} tables...")
+    days = epoch_to_days(ts, unit="ms")
 
-    rows = []
+    return pd.DataFrame({
+        "day": days,
+        "drop%": (o - l) / o * 100.0,
+        "pump%": (h - l) / l * 100.0,
+        "range%": (h - l) / o * 100.0,
+    })
 
-    for tbl in tables:
-        tbl_q = quote_ident(tbl)
 
-        q = f"""
-            SELECT {TIME_COL}, {OPEN_COL}, {HIGH_COL}, {LOW_COL}
-            FROM {tbl_q};
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _band_moments(x, lower, upper):
         """
+        Count, mean and sample std (ddof=1) of the values of x inside
+        [lower, upper], without materializing the trimmed array. Mean and
+        std are NaN when nothing is inside, the std also with just one value.
+        """
+        n = 0
+        total = 0.0
+        for i in prange(x.shape[0]):
+            v = x[i]
+            if v >= lower and v <= upper:
+                n += 1
+                total += v
+
+        if n == 0:
+            return 0, np.nan, np.nan
+        mean = total / n
+
+        ss = 0.0
+        for i in prange(x.shape[0]):
+            v = x[i]
+            if v >= lower and v <= upper:
+                d = v - mean
+                ss += d * d
+
+        if n < 2:
+            return n, mean, np.nan
+        return n, mean, np.sqrt(ss / (n - 1))
+else:
+    def _band_moments(x, lower, upper):
+        kept = x[(x >= lower) & (x <= upper)]
+        if kept.size == 0:
+            return 0, np.nan, np.nan
+        if kept.size < 2:
+            return kept.size, kept.mean(), np.nan
+        return kept.size, kept.mean(), kept.std(ddof=1)
+
+
+def trimmed_stats(values, lo_q, hi_q):
+    """
+    Trim values to their [lo_q, hi_q] quantile band and return
+    (lower, upper, n_kept, mean, std), in two passes over the array.
+    No values (after dropping NaN) gives (nan, nan, 0, nan, nan).
+    """
+    x = np.ascontiguousarray(values, dtype=np.float64)
+    x = x[~np.isnan(x)]
+    if x.size == 0:
+        return np.nan, np.nan, 0, np.nan, np.nan
 
-        with conn.cursor() as cur:
-            try:
-                cur.execute(q)
-            except Exception as e:
-                print(f"Skipping {tbl} due to error: {e}")
-                continue
-
-            data = cur.fetchall()
-
-        for ts_ms, o, h, l in data:
-            if o is None or h is None or l is None:
-                continue
-            if o <= 0 or h <= 0 or l <= 0:
-                continue
+    lower, upper = np.quantile(x, [lo_q, hi_q])
+    n_kept, mu, sigma = _band_moments(x, lower, upper)
+    return lower, upper, n_kept, mu, sigma
 
-            day = ts_to_day(ts_ms)
 
-            drop_pct  = (o - l) / o * 100.0
-            pump_pct  = (h - l) / l * 100.0
-            range_pct = (h - l) / o * 100.0
+def main():
+    conn = psycopg2.connect(dbname=DB_NAME, **DB_CONFIG)
+    tables = daily_rollup.get_spot_1d_tables(conn)
 
-            rows.append((day, drop_pct, pump_pct, range_pct))
+    print(f"Processing {len(tables)} tables...")
 
-    df = pd.DataFrame(rows, columns=["day", "drop%", "pump%", "range%"])
+    df = None
+    if USE_DAILY_ROLLUP:
+        df = daily_rollup.read_rollup(
+            conn, "day, drop_pct, pump_pct, range_pct", "is_valid",
+            STATS_COLUMNS, refresh=REFRESH_ROLLUP,
+        )
+    if df is None:
+        df = daily_rollup.read_tables(
+            conn, tables, [TIME_COL, OPEN_COL, HIGH_COL, LOW_COL],
+            candle_stats, STATS_COLUMNS, use_cache=USE_PARQUET_CACHE,
+        )
     print(f"Total rows: {len(df)}")
 
     hist = df[df["day"] < TARGET_DAY]
@@ -126,19 +167,13 @@ def main():
     # pump% and range% — trimmed tails
     # ================================
     for col in ["pump%", "range%"]:
-        lower = hist[col].quantile(0.001)
-        upper = hist[col].quantile(0.999)
-
-        hist_t = hist[(hist[col] >= lower) & (hist[col] <= upper)]
-
-        mu = hist_t[col].mean()
-        sigma = hist_t[col].std()
+        lower, upper, n_kept, mu, sigma = trimmed_stats(hist[col].to_numpy(), 0.001, 0.999)
         oct_med = oct10[col].median()
         z = (oct_med - mu) / sigma
 
         print(f"\n=== {col} (trimmed) ===")
         print(f"Bounds: [{lower:.4f}, {upper:.4f}]")
-        print(f"Rows kept: {len(hist_t)} / {len(hist)}")
+        print(f"Rows kept: {n_kept} / {len(hist)}")
         print(f"mean : {mu:.4f}")
         print(f"std  : {sigma:.4f}")
         print(f"oct10 median: {oct_med:.4f}")
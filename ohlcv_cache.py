@@ -0,0 +1,126 @@
+"""
+Local Parquet cache of raw OHLC columns, one file per table.
+
+The first run pulls the full table from Postgres; later runs only pull
+candles from the last cached timestamp on and append them, so repeat
+analysis reads from local disk instead of re-downloading every table.
+The last cached candle is always re-fetched and replaced: it may have
+been cached while that candle was still open.
+Top-ups for many tables go out as one UNION ALL COPY per BATCH_SIZE
+tables rather than one round trip per table.
+
+Requires pyarrow. Callers should check HAVE_PYARROW and query Postgres
+directly when it's missing.
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+
+from pg_helpers import copy_to_file, quote_ident, quote_literal, run_chunked
+
+try:
+    import pyarrow  # noqa: F401
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+
+CACHE_DIR = "ohlcv_cache"
+
+# Tables per UNION ALL top-up query
+BATCH_SIZE = 500
+
+
+def cache_path(table, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{table.replace(':', '__')}.parquet")
+
+
+def read_cached(table, columns, cache_dir=CACHE_DIR):
+    path = cache_path(table, cache_dir)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path, columns=columns, memory_map=True)
+
+
+def topup_query(table, columns, cached):
+    """
+    SELECT for the rows of `table` not in the cache yet plus the last cached
+    candle (possibly cached while still open), tagged with the table name so
+    several can share one UNION ALL.
+    """
+    time_col = columns[0]
+    q = f"SELECT {quote_literal(table)}::text AS tablename, {', '.join(columns)} FROM {quote_ident(table)}"
+    if cached is not None and not cached.empty:
+        q += f" WHERE {time_col} >= {int(cached[time_col].max())}"
+    return q
+
+
+def fetch_topups(conn, tables, columns, cached):
+    """
+    Pull the missing rows (and each table's last cached candle) for every
+    table in one COPY round trip.
+    Returns {table: DataFrame} for tables that returned rows.
+    """
+    query = "\nUNION ALL\n".join(topup_query(t, columns, cached[t]) for t in tables)
+
+    with tempfile.TemporaryFile() as buf:
+        if not copy_to_file(conn, query, buf):
+            return {}
+
+        fresh = pd.read_csv(
+            buf,
+            header=None,
+            names=["tablename"] + columns,
+            dtype={c: "float64" for c in columns[1:]},
+        )
+
+    return {
+        tbl: grp.drop(columns="tablename").reset_index(drop=True)
+        for tbl, grp in fresh.groupby("tablename", sort=False)
+    }
+
+
+def load_ohlc_many(conn, tables, columns, cache_dir=CACHE_DIR):
+    """
+    Return {table: DataFrame with `columns`} (first column must be the
+    integer timestamp), topping up each table's Parquet file with any newer
+    candles and refreshing its last cached one. Prices are stored as float64 columns, timestamps as int64.
+    Tables that fail to query are reported and left out.
+    """
+    out = {}
+    cached = {t: read_cached(t, columns, cache_dir) for t in tables}
+
+    batches = run_chunked(
+        conn,
+        tables,
+        lambda batch: (batch, fetch_topups(conn, batch, columns, cached)),
+        BATCH_SIZE,
+    )
+
+    for batch, fresh in batches:
+        for t in batch:
+            prev, new = cached[t], fresh.get(t)
+
+            if new is None:
+                out[t] = prev if prev is not None else pd.DataFrame(columns=columns)
+                continue
+
+            if prev is not None and not prev.empty:
+                # The re-fetched last candle replaces the cached copy
+                last = prev[columns[0]].max()
+                stale = prev[columns[0]] >= last
+                if new.equals(prev[stale].reset_index(drop=True)):
+                    out[t] = prev  # nothing changed; skip the rewrite
+                    continue
+                prev = prev[~stale]
+
+            df = new if prev is None else pd.concat([prev, new], ignore_index=True)
+
+            os.makedirs(cache_dir, exist_ok=True)
+            df.to_parquet(cache_path(t, cache_dir), compression="zstd", index=False)
+            out[t] = df
+
+    return out
+
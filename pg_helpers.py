@@ -0,0 +1,205 @@
+"""
+Small Postgres helpers shared by the analysis scripts.
+
+- ensure_timestamp_indexes: make sure windowed queries on the OHLCV
+  tables can use an index range scan instead of a full table scan
+- copy_to_file: stream a query out via COPY ... TO STDOUT (CSV)
+- copy_frame_to_table: load a DataFrame into a table via COPY ... FROM STDIN
+- register_numeric_as_float: have psycopg2 return NUMERIC as float
+- run_chunked: run a per-chunk UNION ALL query, falling back to one table
+  at a time when a bad table fails the chunk
+"""
+
+import hashlib
+import io
+
+import psycopg2.errors
+import psycopg2.extensions
+
+
+# NUMERIC -> float instead of Decimal, so DataFrames built from fetched rows
+# get native float64 columns without an astype pass
+DEC2FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "DEC2FLOAT",
+    lambda value, cur: float(value) if value is not None else None,
+)
+
+
+def quote_ident(name: str) -> str:
+    """
+    Safely quote a Postgres identifier, even if it contains :, ., or caps.
+    """
+    escaped = name.replace('"', '""')
+    return f'"{escaped}"'
+
+
+def quote_literal(value: str) -> str:
+    """
+    Quote a string as a Postgres literal.
+    """
+    escaped = value.replace("'", "''")
+    return f"'{escaped}'"
+
+
+def register_numeric_as_float(conn_or_curs=None):
+    """
+    Register DEC2FLOAT globally, or only on one connection / cursor.
+    """
+    psycopg2.extensions.register_type(DEC2FLOAT, conn_or_curs)
+
+
+def copy_to_file(conn, query, fileobj, params=None):
+    """
+    Run `query` through COPY ... TO STDOUT (CSV) into fileobj, so rows
+    arrive as one raw stream instead of per-value Python objects.
+    COPY can't take bind parameters, so `params` (if given) are inlined with
+    mogrify on the same cursor first.
+    Returns the number of bytes written; fileobj is rewound for reading.
+    """
+    with conn.cursor() as cur:
+        if params is not None:
+            query = cur.mogrify(query, params).decode()
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT CSV)", fileobj)
+    n_bytes = fileobj.tell()
+    fileobj.seek(0)
+    return n_bytes
+
+
+def copy_frame_to_table(conn, df, table):
+    """
+    Load the rows of DataFrame `df` into `table` (columns matched by name)
+    with one COPY ... FROM STDIN (CSV).
+    Returns the number of rows loaded.
+    """
+    buf = io.BytesIO()
+    df.to_csv(buf, header=False, index=False)
+    buf.seek(0)
+
+    cols = ", ".join(quote_ident(c) for c in df.columns)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {quote_ident(table)} ({cols}) FROM STDIN WITH (FORMAT CSV)", buf)
+    return len(df)
+
+
+def run_chunked(conn, tables, run_one_chunk, chunk_size=None, savepoint=False):
+    """
+    Call run_one_chunk(chunk) for each chunk_size slice of `tables` (all of
+    them at once if chunk_size is None), so each chunk is one UNION ALL
+    statement. One bad table fails the whole statement, so a failing chunk
+    is rolled back and retried one table at a time; tables that still fail
+    are reported and skipped.
+    With savepoint=True only the failed statement is rolled back (to a
+    savepoint) instead of the whole transaction, for callers that have
+    already done work in it.
+    Returns the run_one_chunk results, in order, for the calls that succeeded.
+    """
+    if chunk_size is None:
+        chunk_size = max(len(tables), 1)
+
+    out = []
+    for i in range(0, len(tables), chunk_size):
+        chunk = tables[i:i + chunk_size]
+
+        try:
+            if savepoint:
+                with conn.cursor() as cur:
+                    cur.execute("SAVEPOINT run_chunk")
+            out.append(run_one_chunk(chunk))
+            if savepoint:
+                with conn.cursor() as cur:
+                    cur.execute("RELEASE SAVEPOINT run_chunk")
+        except Exception as e:
+            if savepoint:
+                with conn.cursor() as cur:
+                    cur.execute("ROLLBACK TO SAVEPOINT run_chunk")
+                    cur.execute("RELEASE SAVEPOINT run_chunk")
+            else:
+                conn.rollback()
+
+            if len(chunk) == 1:
+                if isinstance(e, psycopg2.errors.UndefinedTable):
+                    print(f"  Skipping missing table: {chunk[0]}")
+                else:
+                    print(f"  ERROR querying {chunk[0]}: {e}")
+                continue
+
+            out.extend(run_chunked(conn, chunk, run_one_chunk, 1, savepoint))
+
+    return out
+
+
+def timestamp_index_name(table, time_col):
+    """
+    Deterministic index name that stays under Postgres' 63-byte limit
+    (long table names are truncated, so a short hash keeps them unique).
+    """
+    digest = hashlib.md5(table.encode()).hexdigest()[:8]
+    return f"{table[:40]}_{digest}_{time_col[:4]}_idx"
+
+
+def ensure_timestamp_indexes(conn, tables, time_col="timestamp"):
+    """
+    Make sure every table in `tables` has a btree index whose leading column
+    is `time_col`; missing ones are built with CREATE INDEX CONCURRENTLY so
+    ingest into the same tables isn't blocked. INVALID indexes (left behind
+    by a failed or cancelled concurrent build) don't count and are dropped
+    before the rebuild.
+    Returns the number of indexes created.
+    """
+    if not tables:
+        return 0
+
+    query = """
+        SELECT t.relname, ic.relname, i.indisvalid
+        FROM pg_index i
+        JOIN pg_class ic     ON ic.oid = i.indexrelid
+        JOIN pg_class t      ON t.oid = i.indrelid
+        JOIN pg_namespace n  ON n.oid = t.relnamespace
+        JOIN pg_attribute a  ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+        WHERE n.nspname = 'public'
+          AND a.attname = %s
+          AND t.relname = ANY(%s);
+    """
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    conn.commit()
+    prev_autocommit = conn.autocommit
+    conn.autocommit = True
+
+    created = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, (time_col, list(tables)))
+            rows = cur.fetchall()
+            covered = {tbl for tbl, _, valid in rows if valid}
+
+            invalid = {}
+            for tbl, idx, valid in rows:
+                if not valid:
+                    invalid.setdefault(tbl, []).append(idx)
+
+            for tbl in tables:
+                if tbl in covered:
+                    continue
+
+                idx = timestamp_index_name(tbl, time_col)
+                try:
+                    for bad in invalid.get(tbl, []):
+                        print(f"  Dropping invalid index {bad} on {tbl}")
+                        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {quote_ident(bad)};")
+
+                    cur.execute(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote_ident(idx)} "
+                        f"ON {quote_ident(tbl)} ({quote_ident(time_col)});"
+                    )
+                    created += 1
+                except Exception as e:
+                    print(f"  Could not index {tbl}: {e}")
+    finally:
+        conn.autocommit = prev_autocommit
+
+    if created:
+        print(f"  Created {created} {time_col} indexes.")
+
+    return created
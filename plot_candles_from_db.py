@@ -9,12 +9,16 @@ PostgreSQL Candle Visualizer (hard-coded config, human-readable time window)
 - Candles plotted on true time axis; gaps in timestamps show up as visual gaps.
 """
 
+import io
 import psycopg2
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from matplotlib.patches import Rectangle
+from matplotlib.collections import LineCollection, PolyCollection
+
+from pg_helpers import ensure_timestamp_indexes
+from time_bounds import build_time_bounds
 
 
 # ================== HARD-CODED DATABASE CONFIG ==================
@@ -57,6 +61,9 @@ CONFIG = {
 
     "start_time_str": "2025-10-10 21:09:00",  # <- edit
     "end_time_str":   "2025-10-10 22:00:00",  # <- edit
+
+    # Build a btree index on timestamp_col if the table is missing one
+    "ensure_ts_index": True,
 }
 
 # ================================================================
@@ -75,26 +82,6 @@ def connect_to_db():
     return conn
 
 
-def build_time_bounds(start_str, end_str, unit):
-    """
-    Convert human-readable datetime strings to numeric Unix timestamps
-    in the specified unit ("s" or "ms").
-    Returns (start_ts, end_ts) where each can be None.
-    """
-    def to_epoch(s):
-        if s is None:
-            return None
-        dt = pd.to_datetime(s)
-        ts = dt.timestamp()  # seconds
-        if unit == "ms":
-            ts *= 1000.0
-        return int(ts)
-
-    start_ts = to_epoch(start_str) if start_str else None
-    end_ts = to_epoch(end_str) if end_str else None
-    return start_ts, end_ts
-
-
 def build_query(cfg, start_ts, end_ts):
     t = cfg["table_name"]
     ts_col = cfg["timestamp_col"]
@@ -151,7 +138,20 @@ def fetch_candles(conn, cfg):
     print(query)
     print("Params:", params)
 
-    df = pd.read_sql_query(query, conn, params=params)
+    # COPY ... TO STDOUT and let pandas' C parser build the columns,
+    # rather than going through pd.read_sql_query on a raw DBAPI connection.
+    columns = ["ts", "o", "h", "l", "c", "v"]
+    buf = io.BytesIO()
+    with conn.cursor() as cur:
+        sql = cur.mogrify(query, params).decode()
+        cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT CSV)", buf)
+
+    if buf.tell() == 0:
+        df = pd.DataFrame(columns=columns)
+    else:
+        buf.seek(0)
+        df = pd.read_csv(buf, header=None, names=columns)
+
     print(f"Fetched {len(df)} rows.")
     return df
 
@@ -178,17 +178,17 @@ def detect_gaps(df, cfg):
     if df.empty or len(df) < 2:
         return []
 
-    times = df.index.to_pydatetime()
-    secs = np.array([t.timestamp() for t in times])
-    diffs = np.diff(secs)
+    # Work on the raw datetime64 values; only the gap endpoints are
+    # turned back into Python datetimes.
+    diffs = np.diff(df.index.values) / np.timedelta64(1, "s")
 
-    gaps = []
-    for i, delta in enumerate(diffs):
-        if delta > 1.5 * timeframe_sec:
-            gap_start = times[i]
-            gap_end = times[i + 1]
-            multiple = delta / timeframe_sec
-            gaps.append((gap_start, gap_end, multiple))
+    idx = np.flatnonzero(diffs > 1.5 * timeframe_sec)
+    multiples = diffs[idx] / timeframe_sec
+
+    gap_starts = df.index[idx].to_pydatetime()
+    gap_ends = df.index[idx + 1].to_pydatetime()
+
+    gaps = list(zip(gap_starts, gap_ends, multiples))
 
     return gaps
 
@@ -222,27 +222,38 @@ def plot_candles(df, cfg):
 
     fig, ax = plt.subplots(figsize=(14, 7))
 
-    for x, o, h, l, c in zip(date_nums, opens, highs, lows, closes):
-        # Wick
-        ax.plot([x, x], [l, h], linewidth=1)
-
-        # Body
-        color = "green" if c >= o else "red"
-        lower = min(o, c)
-        height = abs(c - o)
-        if height == 0:
-            # Make perfectly flat candles visible
-            height = (max(highs) - min(lows)) * 0.001
-
-        rect = Rectangle(
-            (x - candle_width / 2.0, lower),
-            candle_width,
-            height,
-            edgecolor="black",
-            facecolor=color,
-            linewidth=0.5,
-        )
-        ax.add_patch(rect)
+    # Wicks: one segment per candle, drawn as a single collection
+    wicks = np.stack([
+        np.column_stack([date_nums, lows]),
+        np.column_stack([date_nums, highs]),
+    ], axis=1)
+    ax.add_collection(LineCollection(wicks, colors="black", linewidths=1))
+
+    # Bodies: one rectangle per candle, drawn as a single collection
+    lower = np.minimum(opens, closes)
+    height = np.abs(closes - opens)
+    # Make perfectly flat candles visible
+    height = np.where(height == 0, (highs.max() - lows.min()) * 0.001, height)
+
+    left = date_nums - candle_width / 2.0
+    right = date_nums + candle_width / 2.0
+    top = lower + height
+
+    bodies = np.stack([
+        np.column_stack([left, lower]),
+        np.column_stack([left, top]),
+        np.column_stack([right, top]),
+        np.column_stack([right, lower]),
+    ], axis=1)
+    colors = np.where(closes >= opens, "green", "red")
+    ax.add_collection(PolyCollection(
+        bodies,
+        facecolors=colors,
+        edgecolors="black",
+        linewidths=0.5,
+    ))
+
+    ax.autoscale_view()
 
     ax.set_xlabel("Time")
     ax.set_ylabel("Price")
@@ -273,6 +284,9 @@ def main():
 
     conn = connect_to_db()
     try:
+        if CONFIG["ensure_ts_index"]:
+            ensure_timestamp_indexes(conn, [CONFIG["table_name"]], CONFIG["timestamp_col"])
+
         df_raw = fetch_candles(conn, CONFIG)
         df = prepare_dataframe(df_raw, CONFIG)
 
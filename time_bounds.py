@@ -0,0 +1,41 @@
+"""
+Small time helpers shared by the analysis scripts.
+
+- build_time_bounds: human-readable window -> Unix timestamps
+- epoch_to_days:     array of Unix timestamps -> UTC calendar days (vectorized)
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def to_epoch(s, unit="ms"):
+    """
+    Convert a human-readable datetime string (anything pandas.to_datetime
+    understands, naive = UTC) to a Unix timestamp in the specified unit
+    ("s" or "ms"). Returns None for None / empty input.
+    """
+    if not s:
+        return None
+    ts = pd.to_datetime(s).timestamp()  # seconds
+    if unit == "ms":
+        ts *= 1000.0
+    return int(ts)
+
+
+def build_time_bounds(start_str, end_str, unit="ms"):
+    """
+    Convert human-readable datetime strings to numeric Unix timestamps
+    in the specified unit ("s" or "ms").
+    Returns (start_ts, end_ts) where each can be None.
+    """
+    return to_epoch(start_str, unit), to_epoch(end_str, unit)
+
+
+def epoch_to_days(ts, unit="ms"):
+    """
+    Convert an array of Unix timestamps to datetime64[D] (UTC day) in one
+    numpy pass, instead of building a pandas Timestamp per value.
+    """
+    ts = np.asarray(ts).astype(np.int64)
+    return ts.astype(f"datetime64[{unit}]").astype("datetime64[D]")
@@ -3,6 +3,9 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+import daily_rollup
+from time_bounds import epoch_to_days
+
 DB_CONFIG = {
     "host": "localhost",
     "port": 5432,
@@ -11,7 +14,6 @@ DB_CONFIG = {
     "password": "YOUR_PASSWORD_HERE",
 }
 
-TABLE_NAME_LIKE = "binance\\_%\\_1d"
 TARGET_DAY = "2025-10-10"
 
 TIME_COL  = "timestamp"
@@ -22,47 +24,50 @@ LOW_COL   = "low"
 OUT_CSV = "daily_volatility_median_only.csv"
 OUT_PNG = "median_volatility_2017_2025_with_oct10.png"
 
+# range_pct from the rollup view (daily_rollup.py), else Parquet cache, else the tables
+USE_DAILY_ROLLUP  = True
+REFRESH_ROLLUP    = False
+USE_PARQUET_CACHE = True
+
 
-def get_binance_1d_tables(conn):
-    q = """
-        SELECT tablename
-        FROM pg_tables
-        WHERE schemaname='public'
-          AND tablename LIKE %s;
+def range_stats(data):
+    """
+    Turn raw (ts_ms, open, high, low) rows into a DataFrame of
+    day / range_pct, computed column-wise.
     """
-    with conn.cursor() as cur:
-        cur.execute(q, (TABLE_NAME_LIKE,))
-        rows = cur.fetchall()
-    return [r[0] for r in rows if ":" not in r[0]]
+    arr = np.asarray(data, dtype=np.float64)
+    if arr.size == 0:
+        return None
 
+    ts, o, h, l = arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3]
 
-def ts_to_day(ts_ms):
-    return pd.to_datetime(ts_ms, unit="ms", utc=True).date()
+    mask = ~(np.isnan(o) | np.isnan(h) | np.isnan(l)) & (o != 0)
+    ts, o, h, l = ts[mask], o[mask], h[mask], l[mask]
 
+    days = epoch_to_days(ts, unit="ms")
 
-def compute_daily_volatility(conn):
-    tables = get_binance_1d_tables(conn)
-    print(f"Found {len(tables)} spot 1d tables.")
+    return pd.DataFrame({
+        "day": days,
+        "range_pct": (h - l) / o * 100.0,
+    })
 
-    rows = []
 
-    for tbl in tables:
-        q = f"SELECT {TIME_COL}, {OPEN_COL}, {HIGH_COL}, {LOW_COL} FROM {tbl};"
-        with conn.cursor() as cur:
-            cur.execute(q)
-            data = cur.fetchall()
-
-        for ts_ms, o, h, l in data:
-            if any(v is None for v in (o, h, l)): 
-                continue
-            if o == 0:
-                continue
+def compute_daily_volatility(conn):
+    tables = daily_rollup.get_spot_1d_tables(conn)
+    print(f"Found {len(tables)} spot 1d tables.")
 
-            day = ts_to_day(ts_ms)
-            range_pct = (float(h) - float(l)) / float(o) * 100.0
-            rows.append((day, range_pct))
+    if USE_DAILY_ROLLUP:
+        df = daily_rollup.read_rollup(
+            conn, "day, range_pct", "range_pct IS NOT NULL",
+            ["day", "range_pct"], refresh=REFRESH_ROLLUP,
+        )
+        if df is not None:
+            return df
 
-    return pd.DataFrame(rows, columns=["day", "range_pct"])
+    return daily_rollup.read_tables(
+        conn, tables, [TIME_COL, OPEN_COL, HIGH_COL, LOW_COL],
+        range_stats, ["day", "range_pct"], use_cache=USE_PARQUET_CACHE,
+    )
 
 
 def main():
@@ -78,7 +83,7 @@ def main():
         daily_stats.to_csv(OUT_CSV)
         print(f"Wrote {OUT_CSV}")
 
-        target_date = pd.to_datetime(TARGET_DAY).date()
+        target_date = pd.Timestamp(TARGET_DAY)
         oct10_median = daily_stats.loc[target_date]["median"]
         print(f"\nOct 10 Median Volatility = {oct10_median:.2f}%")
 
@@ -1,7 +1,37 @@
+import io
+import warnings
+
 import psycopg2
+import psycopg2.pool
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use("Agg")  # charts only go to PNG files
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+try:
+    import pyarrow  # noqa: F401
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+from pg_helpers import (
+    copy_frame_to_table,
+    copy_to_file,
+    ensure_timestamp_indexes,
+    quote_ident,
+    quote_literal,
+    run_chunked,
+)
+from time_bounds import build_time_bounds
 
 # ==========================================================
 # CONFIG
@@ -35,6 +65,9 @@ END_TIME_STR   = "2025-10-10 22:00:00"
 # Timestamp unit in your DB
 TS_UNIT = "ms"   # change to "s" if timestamps are in seconds
 
+# One 1m bar, in TS_UNIT (spacing of the minute grid)
+BAR_INTERVAL = 60 * 1000 if TS_UNIT == "ms" else 60
+
 # Column names in your OHLCV tables
 TIME_COL   = "timestamp"
 HIGH_COL   = "high"
@@ -43,7 +76,34 @@ LOW_COL    = "low"
 # Only consider these quote assets (treat all as USD-ish)
 USD_QUOTES = {"usd", "usdt", "usdc", "eur"}
 
+# Build a btree index on TIME_COL for any table missing one (one-off cost)
+ENSURE_TS_INDEXES = True
+
+# How many tables to fold into one UNION ALL statement
+OHLC_CHUNK_SIZE = 128
+
+# Column order of the per-market basis CSV
+BASIS_COLUMNS = [
+    "dt",
+    "spot_high", "spot_low", "spot_mid",
+    "fut_high", "fut_low", "fut_mid",
+    "basis_mid_pct", "basis_high_pct", "basis_low_pct",
+    "exchange", "base", "quote",
+]
+
+# Compute the per-minute median basis inside each exchange's Postgres
+# (percentile_cont against a temp copy of the Binance spot windows) instead
+# of pulling every futures row into pandas. No per-market CSV in this mode.
+SERVER_SIDE_MEDIANS = False
+
+# Rows per write when streaming the per-market CSV out
+CSV_CHUNK_ROWS = 100_000
+
+# Exchanges processed at once (one DB connection each)
+EXCHANGE_WORKERS = len(EXCHANGES_FUTURES)
+
 OUT_CSV       = "futures_vs_binance_spot_basis_2025-10-10_2109_2200_with_high_low.csv"
+OUT_PARQUET   = "futures_vs_binance_spot_basis_2025-10-10_2109_2200_with_high_low.parquet"
 OUT_PNG_MID   = "median_mid_basis_vs_binance_spot_2025-10-10_2109_2200.png"
 OUT_PNG_HIGH  = "median_high_basis_vs_binance_spot_2025-10-10_2109_2200.png"
 OUT_PNG_LOW   = "median_low_basis_vs_binance_spot_2025-10-10_2109_2200.png"
@@ -53,119 +113,490 @@ OUT_PNG_LOW   = "median_low_basis_vs_binance_spot_2025-10-10_2109_2200.png"
 # HELPERS
 # ==========================================================
 
-def build_time_bounds(start_str, end_str, unit="ms"):
-    def to_epoch(s):
-        dt = pd.to_datetime(s)
-        ts = dt.timestamp()  # seconds
-        if unit == "ms":
-            ts *= 1000
-        return int(ts)
-
-    return to_epoch(start_str), to_epoch(end_str)
-
-
-def quote_ident(name: str) -> str:
+def ts_to_dt(ts, unit="ms"):
     """
-    Safely quote a Postgres identifier, even if it contains :, ., or caps.
+    Epoch timestamp(s) -> UTC datetime. Pass a whole int64 array to convert
+    a column in one vectorized call.
     """
-    escaped = name.replace('"', '""')
-    return f'"{escaped}"'
-
-
-def ts_to_dt(ts, unit="ms"):
-    if unit == "ms":
-        return pd.to_datetime(ts, unit="ms", utc=True)
-    else:
-        return pd.to_datetime(ts, unit="s", utc=True)
+    return pd.to_datetime(ts, unit=unit, utc=True)
 
 
 def get_spot_and_futures_tables(conn, exchange_lower: str):
     """
     Returns:
-        spot_tables    = [ ... ]
-        futures_tables = [ ... ]
+        spot_tables    = [(table, base, quote), ...]
+        futures_tables = [(table, base, quote), ...]
 
     Spot tables:    exchange_base_quote_1m
     Futures tables: exchange_base_quote:quote_1m (contain colon)
 
-    We also skip tables with spaces/dots to avoid weird names.
+    Matching, base/quote extraction (lowercase) and the USD-like quote
+    filter all happen server-side in one regexp_match pass over pg_tables;
+    a LIKE prefix filter first narrows pg_tables to this exchange's _1m
+    tables so the regex only runs on those.
+    Tables with spaces/dots are skipped to avoid weird names.
     """
-    pattern = f"{exchange_lower}\\_%\\_1m"
-
     query = """
-        SELECT tablename
-        FROM pg_tables
-        WHERE schemaname='public'
-          AND tablename LIKE %s;
+        SELECT
+            tablename,
+            lower(m[1]) AS base,
+            lower(m[2]) AS quote,
+            position(':' in tablename) > 0 AS is_fut
+        FROM pg_tables,
+             LATERAL regexp_match(
+                 tablename, '^' || %s || '_([^_:]+)[_:]([^_:]+)([_:].*)?_1m$'
+             ) AS m
+        WHERE schemaname = 'public'
+          AND tablename LIKE %s
+          AND tablename !~ '[ .]'
+          AND lower(m[2]) = ANY(%s);
     """
+    like = exchange_lower + r"\_%\_1m"
 
     with conn.cursor() as cur:
-        cur.execute(query, (pattern,))
+        cur.execute(query, (exchange_lower, like, sorted(USD_QUOTES)))
         rows = cur.fetchall()
 
     spot, fut = [], []
-    for (name,) in rows:
-        if " " in name or "." in name:
-            continue
-        if ":" in name:
-            fut.append(name)
+    for name, base, quote, is_fut in rows:
+        if is_fut:
+            fut.append((name, base, quote))
         else:
-            spot.append(name)
+            spot.append((name, base, quote))
 
     return spot, fut
 
 
-def parse_market_from_table(table: str):
+def fetch_ohlc_windows_chunk(conn, tables, start_ts: int, end_ts: int):
+    """
+    Fetch timestamp, high, low for every table in `tables` on the minute grid
+    [start_ts, end_ts] in a single UNION ALL round trip, streamed out with
+    COPY so pandas' C parser builds the columns directly. Each table is
+    LEFT JOINed to a generate_series grid, so it returns one row per minute
+    with NULL (NaN) high/low where it has no bar.
+    Returns a DataFrame with columns: tbl, ts, high, low, or None if no
+    rows came back.
+
+    Table names can't be bind parameters, so rather than PREPARE-ing one
+    statement per table, the whole chunk is one statement: Postgres parses
+    and plans once per OHLC_CHUNK_SIZE tables.
     """
-    Normalize futures names by replacing ':' with '_', then parse:
-      exchange_base_quote_1m
-      exchange_base_quote:quote_1m -> same after ':'' -> '_'
-    Returns base, quote (lowercase) or (None, None) if not parseable.
+    columns = ["tbl", "ts", "high", "low"]
+
+    query = "\nUNION ALL\n".join(
+        f"""
+        SELECT
+            {quote_literal(t)} AS tbl,
+            g.ts, w.{HIGH_COL}, w.{LOW_COL}
+        FROM generate_series(%(start_ts)s::bigint, %(end_ts)s::bigint, %(step)s::bigint) AS g(ts)
+        LEFT JOIN (
+            SELECT {TIME_COL}, {HIGH_COL}, {LOW_COL}
+            FROM {quote_ident(t)}
+            WHERE {TIME_COL} >= %(start_ts)s
+              AND {TIME_COL} <= %(end_ts)s
+        ) AS w ON w.{TIME_COL} = g.ts
+        """
+        for t in tables
+    )
+    params = {"start_ts": start_ts, "end_ts": end_ts, "step": BAR_INTERVAL}
+
+    buf = io.BytesIO()
+    n_bytes = copy_to_file(conn, query, buf, params)
+    if not n_bytes:
+        return None
+
+    return pd.read_csv(
+        buf,
+        header=None,
+        names=columns,
+        dtype={"ts": "int64", "high": "float64", "low": "float64"},
+    )
+
+
+def minute_grid(start_ts: int, end_ts: int):
     """
-    norm = table.replace(":", "_")
-    parts = norm.split("_")
-    if len(parts) < 4:
-        return None, None
-    base = parts[1].lower()
-    quote = parts[2].lower()
-    return base, quote
+    The epoch timestamps of every 1m bar in [start_ts, end_ts]; the same
+    grid fetch_ohlc_windows_chunk joins each table to.
+    """
+    return np.arange(start_ts, end_ts + 1, BAR_INTERVAL, dtype=np.int64)
 
 
-def fetch_ohlc_window(conn, table: str, start_ts: int, end_ts: int):
+def fetch_ohlc_windows_bulk(conn, markets, start_ts: int, end_ts: int):
     """
-    Fetch timestamp, high, low, mid price for given table in [start_ts, end_ts].
-    Return DataFrame with columns: dt, high, low, mid
+    Fetch OHLC for many tables on one connection, OHLC_CHUNK_SIZE tables
+    per statement, as a dense panel aligned on minute_grid(start_ts, end_ts).
+    markets is a list of (table, base, quote). Returns (keys, high, low):
+    keys is the (base, quote) of each panel row, high/low are
+    (len(keys), n_minutes) float arrays with NaN where a market has no bar.
+    Tables with no bar in the window are left out; None if none has one.
     """
-    tbl = quote_ident(table)
+    tables = [m[0] for m in markets]
+    frames = run_chunked(
+        conn,
+        tables,
+        lambda chunk: fetch_ohlc_windows_chunk(conn, chunk, start_ts, end_ts),
+        OHLC_CHUNK_SIZE,
+    )
+    frames = [f for f in frames if f is not None]
 
-    query = f"""
-        SELECT {TIME_COL}, {HIGH_COL}, {LOW_COL}
-        FROM {tbl}
-        WHERE {TIME_COL} >= %s
-          AND {TIME_COL} <= %s;
+    if not frames:
+        return None
+
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    # Every row sits on the grid, so (table, minute offset) is its slot
+    n_minutes = len(minute_grid(start_ts, end_ts))
+    row = pd.Index(tables).get_indexer(df["tbl"])
+    col = (df["ts"].to_numpy() - start_ts) // BAR_INTERVAL
+
+    high = np.full((len(tables), n_minutes), np.nan)
+    low  = np.full((len(tables), n_minutes), np.nan)
+    high[row, col] = df["high"].to_numpy()
+    low[row, col]  = df["low"].to_numpy()
+
+    has_bars = ~(np.isnan(high) & np.isnan(low)).all(axis=1)
+    if not has_bars.any():
+        return None
+
+    keys = [(base, quote) for (_, base, quote), keep in zip(markets, has_bars) if keep]
+    return keys, high[has_bars], low[has_bars]
+
+
+def panel_to_frame(keys, high, low, grid):
+    """
+    Long DataFrame[base, quote, ts, high, low, mid] of the bars a panel from
+    fetch_ohlc_windows_bulk actually has (grid gaps dropped).
+    """
+    k, j = np.nonzero(~(np.isnan(high) & np.isnan(low)))
+    keys = np.array(keys, dtype=object).reshape(-1, 2)
+
+    return pd.DataFrame({
+        "base":  keys[k, 0],
+        "quote": keys[k, 1],
+        "ts":    grid[j],
+        "high":  high[k, j],
+        "low":   low[k, j],
+        "mid":   (high[k, j] + low[k, j]) / 2.0,
+    })
+
+
+def stage_futures_chunk(conn, pairs, start_ts: int, end_ts: int):
+    """
+    INSERT the window rows of every (fut_table, base, quote) in `pairs` into
+    the fut_window temp table with one UNION ALL statement.
     """
+    query = "INSERT INTO fut_window (base, quote, ts, fut_high, fut_low)\n" + "\nUNION ALL\n".join(
+        f"""
+        SELECT
+            {quote_literal(base)}, {quote_literal(quote)},
+            {TIME_COL}, {HIGH_COL}, {LOW_COL}
+        FROM {quote_ident(t)}
+        WHERE {TIME_COL} >= %(start_ts)s
+          AND {TIME_COL} <= %(end_ts)s
+        """
+        for t, base, quote in pairs
+    )
+    params = {"start_ts": start_ts, "end_ts": end_ts}
 
     with conn.cursor() as cur:
+        cur.execute(query, params)
+
+
+def fetch_exchange_medians(conn, ex, pairs, spot_df, start_ts: int, end_ts: int):
+    """
+    Server-side alternative to pulling the futures rows: stage this exchange's
+    futures windows and the matching prefetched Binance spot windows in temp
+    tables, then let Postgres compute the per-minute median basis with
+    percentile_cont(0.5). Only one row per minute crosses the wire.
+    A zero spot price gives a NULL basis, which the median skips, instead
+    of failing the whole query with a division by zero.
+    Returns DataFrame[ts, basis_mid_pct, basis_high_pct, basis_low_pct],
+    or None if nothing matched.
+    """
+    columns = ["ts", "basis_mid_pct", "basis_high_pct", "basis_low_pct"]
+
+    # Median of (futures - spot) / spot * 100 for one price column
+    def median_basis(fut_px, spot_px):
+        return (
+            f"percentile_cont(0.5) WITHIN GROUP "
+            f"(ORDER BY ({fut_px} - s.{spot_px}) / NULLIF(s.{spot_px}, 0) * 100.0)"
+        )
+
+    query = f"""
+        SELECT
+            f.ts,
+            {median_basis("(f.fut_high + f.fut_low) / 2.0", "spot_mid")} AS basis_mid_pct,
+            {median_basis("f.fut_high", "spot_high")} AS basis_high_pct,
+            {median_basis("f.fut_low", "spot_low")} AS basis_low_pct
+        FROM fut_window f
+        JOIN binance_spot s USING (base, quote, ts)
+        GROUP BY f.ts
+        ORDER BY f.ts
+    """
+
+    buf = io.BytesIO()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE binance_spot (
+                    base text, quote text, ts bigint,
+                    spot_high float8, spot_low float8, spot_mid float8
+                ) ON COMMIT DROP;
+                CREATE TEMP TABLE fut_window (
+                    base text, quote text, ts bigint,
+                    fut_high float8, fut_low float8
+                ) ON COMMIT DROP;
+            """)
+
+        copy_frame_to_table(
+            conn,
+            spot_df[["base", "quote", "ts", "spot_high", "spot_low", "spot_mid"]],
+            "binance_spot",
+        )
+
+        # Savepoints, so a bad table doesn't undo the staged spot rows
+        by_table = {p[0]: p for p in pairs}
+        run_chunked(
+            conn,
+            list(by_table),
+            lambda chunk: stage_futures_chunk(conn, [by_table[t] for t in chunk], start_ts, end_ts),
+            OHLC_CHUNK_SIZE,
+            savepoint=True,
+        )
+
+        n_bytes = copy_to_file(conn, query, buf)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"  ERROR computing server-side medians for {ex}: {e}")
+        return None
+
+    if not n_bytes:
+        return None
+
+    return pd.read_csv(buf, header=None, names=columns, dtype={"ts": "int64"})
+
+
+def process_exchange(ex, binance_pool, spot_df, spot_markets, start_ts, end_ts):
+    """
+    Fetch the crash-window OHLC(mid) of every USD-like futures market on one
+    exchange that has a Binance spot counterpart ((base, quote) in
+    spot_markets). The basis itself is computed in main, in one pass over
+    all exchanges; with SERVER_SIDE_MEDIANS the exchange's Postgres
+    computes the per-minute medians instead (fetch_exchange_medians).
+    Runs from a worker thread: Binance itself uses a connection from
+    binance_pool, every other exchange opens its own connection.
+
+    spot_df (long Binance spot bars) is only needed with SERVER_SIDE_MEDIANS.
+
+    Returns (n_spot_tables, n_fut_tables, n_matched, result), where result
+    is the futures panel (keys, high, low) from fetch_ohlc_windows_bulk, or
+    [ts, basis_mid_pct, basis_high_pct, basis_low_pct, exchange] medians
+    with SERVER_SIDE_MEDIANS (None if nothing matched); None if the
+    exchange DB can't be reached.
+    """
+    dbname = DB_TEMPLATE.format(ex)
+    ex_lower = ex.lower()
+
+    # Use a pooled Binance connection for Binance itself
+    if ex == BINANCE_EXCHANGE_NAME:
+        conn_ex = binance_pool.getconn()
+    else:
         try:
-            cur.execute(query, (start_ts, end_ts))
-        except psycopg2.errors.UndefinedTable:
-            print(f"  Skipping missing table: {table}")
-            return pd.DataFrame()
+            conn_ex = psycopg2.connect(dbname=dbname, **DB_CONFIG)
         except Exception as e:
-            print(f"  ERROR querying {table}: {e}")
-            return pd.DataFrame()
-
-        rows = cur.fetchall()
+            print(f"{ex}: could not connect to {dbname}: {e}")
+            return None
 
-    if not rows:
-        return pd.DataFrame()
+    try:
+        spot_tables_ex, fut_tables_ex = get_spot_and_futures_tables(conn_ex, ex_lower)
+
+        if not fut_tables_ex:
+            return len(spot_tables_ex), 0, 0, None
+
+        # Keep futures markets that have a Binance spot market
+        pairs = [
+            (fut_tbl, base, quote)
+            for fut_tbl, base, quote in fut_tables_ex
+            if (base, quote) in spot_markets
+        ]
+
+        # Only the tables that will actually be queried
+        if ENSURE_TS_INDEXES:
+            ensure_timestamp_indexes(conn_ex, [t for t, _, _ in pairs], TIME_COL)
+
+        if SERVER_SIDE_MEDIANS:
+            keys = {(base, quote) for _, base, quote in pairs}
+            spot_keys = pd.MultiIndex.from_frame(spot_df[["base", "quote"]])
+            medians = fetch_exchange_medians(
+                conn_ex, ex, pairs, spot_df[spot_keys.isin(keys)], start_ts, end_ts
+            )
+            if medians is None:
+                return len(spot_tables_ex), len(fut_tables_ex), len(pairs), None
+            return len(spot_tables_ex), len(fut_tables_ex), len(pairs), medians.assign(exchange=ex)
+
+        # Fetch OHLC for all futures in bulk, aligned on the minute grid
+        panel = fetch_ohlc_windows_bulk(conn_ex, pairs, start_ts, end_ts)
+        if panel is None:
+            return len(spot_tables_ex), len(fut_tables_ex), 0, None
+
+        return len(spot_tables_ex), len(fut_tables_ex), len(panel[0]), panel
 
-    df = pd.DataFrame(rows, columns=["ts", "high", "low"])
-    df["high"] = df["high"].astype(float)
-    df["low"]  = df["low"].astype(float)
-    df["mid"]  = (df["high"] + df["low"]) / 2.0
-    df["dt"]   = df["ts"].apply(lambda x: ts_to_dt(x, TS_UNIT))
-    return df[["dt", "high", "low", "mid"]]
+    finally:
+        if ex == BINANCE_EXCHANGE_NAME:
+            binance_pool.putconn(conn_ex)
+        else:
+            conn_ex.close()
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True, error_model="numpy")
+    def _basis_pct(fut_high, fut_low, spot_high, spot_low, spot_idx, out):
+        """
+        out[i, j] = mid/high/low basis % of futures row i against spot row
+        spot_idx[i] at minute j, reading the spot panel in place instead of
+        copying it out per futures market. error_model="numpy" keeps a zero
+        spot price as inf/nan instead of raising.
+        """
+        for i in prange(fut_high.shape[0]):
+            s = spot_idx[i]
+            for j in range(fut_high.shape[1]):
+                fh = fut_high[i, j]
+                fl = fut_low[i, j]
+                sh = spot_high[s, j]
+                sl = spot_low[s, j]
+                sm = (sh + sl) / 2.0
+                out[i, j, 0] = ((fh + fl) / 2.0 - sm) / sm * 100.0
+                out[i, j, 1] = (fh - sh) / sh * 100.0
+                out[i, j, 2] = (fl - sl) / sl * 100.0
+else:
+    def _basis_pct(fut_high, fut_low, spot_high, spot_low, spot_idx, out):
+        sh = spot_high[spot_idx]
+        sl = spot_low[spot_idx]
+        sm = (sh + sl) / 2.0
+        out[..., 0] = ((fut_high + fut_low) / 2.0 - sm) / sm * 100.0
+        out[..., 1] = (fut_high - sh) / sh * 100.0
+        out[..., 2] = (fut_low - sl) / sl * 100.0
+
+
+def build_basis_pivots(ex_panels, spot_panel, grid):
+    """
+    Line every exchange's futures panel up with the Binance spot panel by
+    position (both are on the same minute grid, so no join is needed),
+    compute mid/high/low basis, write the per-market CSV, and aggregate to
+    the per-minute median basis per exchange.
+    ex_panels is a list of (exchange, keys, high, low).
+    Returns a DataFrame indexed by dt over the whole grid (top column
+    level: basis_*_pct, then exchange), or None if no futures minute
+    matched a spot minute.
+    """
+    spot_keys, spot_high, spot_low = spot_panel
+    spot_row = {key: k for k, key in enumerate(spot_keys)}
+
+    keys = [key for _, ex_keys, _, _ in ex_panels for key in ex_keys]
+    ex_codes = np.concatenate([
+        np.full(len(ex_keys), EXCHANGES_FUTURES.index(ex))
+        for ex, ex_keys, _, _ in ex_panels
+    ])
+    fut_high = np.vstack([high for _, _, high, _ in ex_panels])
+    fut_low  = np.vstack([low for _, _, _, low in ex_panels])
+
+    # The spot panel row of every futures market
+    spot_idx = np.array([spot_row[key] for key in keys])
+
+    # Mid, high, and low basis vs Binance spot, all three at once
+    basis = np.empty(fut_high.shape + (3,), dtype=np.float64)
+    _basis_pct(fut_high, fut_low, spot_high, spot_low, spot_idx, basis)
+
+    # Minutes where both the futures and the spot market have a bar
+    spot_has_bar = ~(np.isnan(spot_high) & np.isnan(spot_low))
+    matched = ~(np.isnan(fut_high) & np.isnan(fut_low)) & spot_has_bar[spot_idx]
+    if not matched.any():
+        return None
+
+    # Aggregate per exchange: median basis per minute, NaN medians where an
+    # exchange has no matched bar (kept so the grid stays gap-free)
+    medians = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN minutes
+        for code in dict.fromkeys(ex_codes):
+            medians[EXCHANGES_FUTURES[code]] = np.nanmedian(basis[ex_codes == code], axis=0)
+
+    dt_index = ts_to_dt(grid, TS_UNIT).rename("dt")
+    pivots = pd.concat(
+        {
+            name: pd.DataFrame({ex: m[:, j] for ex, m in medians.items()}, index=dt_index)
+            for j, name in enumerate(["basis_mid_pct", "basis_high_pct", "basis_low_pct"])
+        },
+        axis=1,
+        names=[None, "exchange"],
+    ).dropna(axis=1, how="all")
+
+    # Int-coded labels: Categorical.from_codes, no string hashing
+    base_cats = sorted({base for base, _ in keys})
+    quote_cats = sorted(USD_QUOTES)
+    base_codes = pd.Categorical([base for base, _ in keys], categories=base_cats).codes
+    quote_codes = pd.Categorical([quote for _, quote in keys], categories=quote_cats).codes
+
+    # Prices are only gathered for the matched (market, minute) rows
+    k, j = np.nonzero(matched)
+    sk = spot_idx[k]
+    fut_h, fut_l = fut_high[k, j], fut_low[k, j]
+    spot_h, spot_l = spot_high[sk, j], spot_low[sk, j]
+    basis_m = basis[k, j]
+
+    out = pd.DataFrame(
+        {
+            "dt":             ts_to_dt(grid[j], TS_UNIT),
+            "spot_high":      spot_h,
+            "spot_low":       spot_l,
+            "spot_mid":       (spot_h + spot_l) / 2.0,
+            "fut_high":       fut_h,
+            "fut_low":        fut_l,
+            "fut_mid":        (fut_h + fut_l) / 2.0,
+            "basis_mid_pct":  basis_m[:, 0],
+            "basis_high_pct": basis_m[:, 1],
+            "basis_low_pct":  basis_m[:, 2],
+            "exchange":       pd.Categorical.from_codes(ex_codes[k], categories=EXCHANGES_FUTURES),
+            "base":           pd.Categorical.from_codes(base_codes[k], categories=base_cats),
+            "quote":          pd.Categorical.from_codes(quote_codes[k], categories=quote_cats),
+        },
+        columns=BASIS_COLUMNS,
+        copy=False,
+    )
+
+    # Save detailed per-market basis data (mid/high/low)
+    out.to_csv(OUT_CSV, index=False, chunksize=CSV_CHUNK_ROWS)
+    print(f"\nWrote per-market basis CSV (mid/high/low): {OUT_CSV}")
+
+    # Columnar copy for downstream analysis (needs pyarrow)
+    if OUT_PARQUET and HAVE_PYARROW:
+        out.to_parquet(OUT_PARQUET, index=False, compression="zstd")
+        print(f"Wrote per-market basis Parquet: {OUT_PARQUET}")
+
+    return pivots
+
+
+def plot_basis(ax, pivot, kind, out_png):
+    """
+    One chart of the per-minute median basis, one line per exchange.
+    kind is "mid", "high" or "low". ax is cleared first, so a single
+    Figure can be reused for every chart.
+    """
+    ax.clear()
+    pivot.plot(ax=ax)
+
+    ax.axhline(0.0, color="black", linewidth=1, linestyle="--", alpha=0.7)
+    ax.set_title(
+        f"Futures vs Binance spot: % difference during crash window ({kind.upper()})\n"
+        f"{START_TIME_STR} → {END_TIME_STR} (UTC), median across markets"
+    )
+    ax.set_ylabel(f"% difference from Binance spot (futures – spot) / spot × 100 ({kind})")
+    ax.set_xlabel("Time (UTC)")
+    ax.legend()
+    ax.grid(True)
+    ax.figure.tight_layout()
+    ax.figure.savefig(out_png, dpi=150)
 
 
 # ==========================================================
@@ -175,211 +606,148 @@ def fetch_ohlc_window(conn, table: str, start_ts: int, end_ts: int):
 def main():
     start_ts, end_ts = build_time_bounds(START_TIME_STR, END_TIME_STR, unit=TS_UNIT)
     print(f"Window ts: {start_ts} -> {end_ts}")
+    grid = minute_grid(start_ts, end_ts)
 
     # ------------------------------------------------------
     # 1) Connect to Binance and build the spot "index" map
     # ------------------------------------------------------
     try:
-        conn_binance = psycopg2.connect(dbname=BINANCE_DB, **DB_CONFIG)
+        # Setup (spot prefetch) and the Binance futures worker
+        binance_pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=1, maxconn=2, dbname=BINANCE_DB, **DB_CONFIG
+        )
     except Exception as e:
         print(f"Could not connect to {BINANCE_DB}: {e}")
         return
 
     try:
-        binance_spot_tables, binance_fut_tables = get_spot_and_futures_tables(
-            conn_binance, BINANCE_EXCHANGE_NAME.lower()
-        )
-        print(f"Binance: {len(binance_spot_tables)} spot tables, {len(binance_fut_tables)} futures tables")
-
-        binance_spot_map = {}  # (base, quote) -> table
+        conn_binance = binance_pool.getconn()
+        try:
+            binance_spot_tables, binance_fut_tables = get_spot_and_futures_tables(
+                conn_binance, BINANCE_EXCHANGE_NAME.lower()
+            )
+            print(f"Binance: {len(binance_spot_tables)} spot tables, {len(binance_fut_tables)} futures tables")
+
+            # (base, quote) -> table
+            binance_spot_map = {
+                (base, quote): tbl for tbl, base, quote in binance_spot_tables
+            }
+
+            print(f"Binance spot index markets (USD-like): {len(binance_spot_map)}")
+
+            if ENSURE_TS_INDEXES:
+                ensure_timestamp_indexes(conn_binance, list(binance_spot_map.values()), TIME_COL)
+
+            # Every exchange compares against the same Binance spot windows,
+            # so fetch them all once up front
+            spot_panel = fetch_ohlc_windows_bulk(
+                conn_binance,
+                [(tbl, base, quote) for (base, quote), tbl in binance_spot_map.items()],
+                start_ts, end_ts,
+            )
+        finally:
+            binance_pool.putconn(conn_binance)
+
+        if spot_panel is None:
+            print("Binance spot markets with data in the window: 0")
+            print("No Binance spot data found in the window.")
+            return
 
-        for tbl in binance_spot_tables:
-            base, quote = parse_market_from_table(tbl)
-            if base is None or quote is None:
-                continue
-            if quote not in USD_QUOTES:
-                continue
-            binance_spot_map[(base, quote)] = tbl
+        print(f"Binance spot markets with data in the window: {len(spot_panel[0])}")
+        spot_markets = set(spot_panel[0])
 
-        print(f"Binance spot index markets (USD-like): {len(binance_spot_map)}")
+        # Server-side medians stage the spot bars as rows:
+        # long format base, quote, ts, spot_high, spot_low, spot_mid
+        spot_df = None
+        if SERVER_SIDE_MEDIANS:
+            spot_df = panel_to_frame(*spot_panel, grid).rename(columns={
+                "high": "spot_high",
+                "low":  "spot_low",
+                "mid":  "spot_mid",
+            })
 
         # ------------------------------------------------------
         # 2) For each exchange futures, compare vs Binance spot
         # ------------------------------------------------------
-        all_basis_rows = []
-
-        for ex in EXCHANGES_FUTURES:
-            dbname = DB_TEMPLATE.format(ex)
-            ex_lower = ex.lower()
-
-            # Use existing Binance connection for Binance itself
-            if ex == BINANCE_EXCHANGE_NAME:
-                conn_ex = conn_binance
-            else:
-                try:
-                    conn_ex = psycopg2.connect(dbname=dbname, **DB_CONFIG)
-                except Exception as e:
-                    print(f"\n===== {ex}: could not connect to {dbname}: {e}")
+        ex_parts = []
+
+        # Exchanges are separate databases, so run them concurrently;
+        # results come back (and are reported) in EXCHANGES_FUTURES order.
+        with ThreadPoolExecutor(max_workers=EXCHANGE_WORKERS) as executor:
+            results = executor.map(
+                lambda ex: process_exchange(
+                    ex, binance_pool, spot_df, spot_markets, start_ts, end_ts
+                ),
+                EXCHANGES_FUTURES,
+            )
+
+            for ex, result in zip(EXCHANGES_FUTURES, results):
+                print(f"\n===== {ex} ({DB_TEMPLATE.format(ex)}) =====")
+                if result is None:
+                    print("  Skipped (no connection)")
                     continue
 
-            print(f"\n===== Processing {ex} ({dbname}) =====")
-
-            try:
-                spot_tables_ex, fut_tables_ex = get_spot_and_futures_tables(conn_ex, ex_lower)
-                print(f"{len(spot_tables_ex)} spot tables, {len(fut_tables_ex)} futures tables")
+                n_spot, n_fut, n_matched, ex_df = result
+                print(f"{n_spot} spot tables, {n_fut} futures tables")
 
-                if not fut_tables_ex:
+                if not n_fut:
                     print("  No futures tables, skipping.")
-                    if ex != BINANCE_EXCHANGE_NAME:
-                        conn_ex.close()
                     continue
 
-                matched_markets = 0
-
-                for fut_tbl in fut_tables_ex:
-                    base, quote = parse_market_from_table(fut_tbl)
-                    if base is None or quote is None:
-                        continue
-                    if quote not in USD_QUOTES:
-                        continue
-
-                    key = (base, quote)
-                    if key not in binance_spot_map:
-                        # No Binance spot for this contract; skip
-                        continue
-
-                    binance_tbl = binance_spot_map[key]
-
-                    # Fetch OHLC(mid) for spot and futures
-                    df_spot = fetch_ohlc_window(conn_binance, binance_tbl, start_ts, end_ts)
-                    df_fut  = fetch_ohlc_window(conn_ex,      fut_tbl,     start_ts, end_ts)
-
-                    if df_spot.empty or df_fut.empty:
-                        continue
-
-                    df_spot = df_spot.rename(columns={
-                        "high": "spot_high",
-                        "low":  "spot_low",
-                        "mid":  "spot_mid",
-                    })
-                    df_fut = df_fut.rename(columns={
-                        "high": "fut_high",
-                        "low":  "fut_low",
-                        "mid":  "fut_mid",
-                    })
-
-                    merged = pd.merge(df_spot, df_fut, on="dt", how="inner")
-                    if merged.empty:
-                        continue
-
-                    # Mid, high, and low basis vs Binance spot
-                    merged["basis_mid_pct"]  = (merged["fut_mid"]  - merged["spot_mid"])   / merged["spot_mid"]   * 100.0
-                    merged["basis_high_pct"] = (merged["fut_high"] - merged["spot_high"]) / merged["spot_high"] * 100.0
-                    merged["basis_low_pct"]  = (merged["fut_low"]  - merged["spot_low"])  / merged["spot_low"]  * 100.0
-
-                    merged["exchange"]  = ex
-                    merged["base"]      = base
-                    merged["quote"]     = quote
-
-                    all_basis_rows.append(merged)
-                    matched_markets += 1
-
-                print(f"  Matched {matched_markets} futures markets vs Binance spot.")
-
-            finally:
-                # Don't close the Binance connection here; it's shared
-                if ex != BINANCE_EXCHANGE_NAME:
-                    conn_ex.close()
+                print(f"  Matched {n_matched} futures markets vs Binance spot.")
+                if ex_df is None:
+                    continue
+                ex_parts.append(ex_df if SERVER_SIDE_MEDIANS else (ex, *ex_df))
 
-        if not all_basis_rows:
+        if not ex_parts:
             print("No futures vs Binance spot pairs found in the window.")
             return
 
-        basis_df = pd.concat(all_basis_rows, ignore_index=True)
-
-        # Save detailed per-market basis data (mid/high/low)
-        basis_df.to_csv(OUT_CSV, index=False)
-        print(f"\nWrote per-market basis CSV (mid/high/low): {OUT_CSV}")
-
         # ------------------------------------------------------
         # 3) Aggregate per exchange: median basis per minute
         # ------------------------------------------------------
-        grouped_mid = basis_df.groupby(["exchange", "dt"])["basis_mid_pct"].median().reset_index()
-        grouped_high = basis_df.groupby(["exchange", "dt"])["basis_high_pct"].median().reset_index()
-        grouped_low = basis_df.groupby(["exchange", "dt"])["basis_low_pct"].median().reset_index()
+        if SERVER_SIDE_MEDIANS:
+            # Medians already computed per exchange; just lay them out
+            medians = pd.concat(ex_parts, ignore_index=True)
+            print("\nServer-side medians: per-market basis CSV not written.")
+
+            pivots = medians.pivot(
+                index="ts",
+                columns="exchange",
+                values=["basis_mid_pct", "basis_high_pct", "basis_low_pct"],
+            )
+            pivots.index = ts_to_dt(pivots.index.to_numpy(), TS_UNIT).rename("dt")
+        else:
+            pivots = build_basis_pivots(ex_parts, spot_panel, grid)
+            if pivots is None:
+                print("No futures vs Binance spot pairs found in the window.")
+                return
 
-        pivot_mid = grouped_mid.pivot(index="dt", columns="exchange", values="basis_mid_pct")
-        pivot_high = grouped_high.pivot(index="dt", columns="exchange", values="basis_high_pct")
-        pivot_low = grouped_low.pivot(index="dt", columns="exchange", values="basis_low_pct")
+        pivot_mid = pivots["basis_mid_pct"]
+        pivot_high = pivots["basis_high_pct"]
+        pivot_low = pivots["basis_low_pct"]
 
         print("\nSample of aggregated median MID basis:")
         print(pivot_mid.head())
 
         # ------------------------------------------------------
-        # 4) Plot MID basis
-        # ------------------------------------------------------
-        plt.figure(figsize=(12, 6))
-        for ex in pivot_mid.columns:
-            plt.plot(pivot_mid.index, pivot_mid[ex], label=ex)
-
-        plt.axhline(0.0, color="black", linewidth=1, linestyle="--", alpha=0.7)
-        plt.title(
-            "Futures vs Binance spot: % difference during crash window (MID)\n"
-            f"{START_TIME_STR} → {END_TIME_STR} (UTC), median across markets"
-        )
-        plt.ylabel("% difference from Binance spot (futures – spot) / spot × 100 (mid)")
-        plt.xlabel("Time (UTC)")
-        plt.legend()
-        plt.grid(True)
-        plt.tight_layout()
-        plt.savefig(OUT_PNG_MID, dpi=150)
-        plt.close()
-        print(f"Wrote median mid-basis chart: {OUT_PNG_MID}")
-
-        # ------------------------------------------------------
-        # 5) Plot HIGH basis
-        # ------------------------------------------------------
-        plt.figure(figsize=(12, 6))
-        for ex in pivot_high.columns:
-            plt.plot(pivot_high.index, pivot_high[ex], label=ex)
-
-        plt.axhline(0.0, color="black", linewidth=1, linestyle="--", alpha=0.7)
-        plt.title(
-            "Futures vs Binance spot: % difference during crash window (HIGH)\n"
-            f"{START_TIME_STR} → {END_TIME_STR} (UTC), median across markets"
-        )
-        plt.ylabel("% difference from Binance spot (futures – spot) / spot × 100 (high)")
-        plt.xlabel("Time (UTC)")
-        plt.legend()
-        plt.grid(True)
-        plt.tight_layout()
-        plt.savefig(OUT_PNG_HIGH, dpi=150)
-        plt.close()
-        print(f"Wrote median high-basis chart: {OUT_PNG_HIGH}")
-
-        # ------------------------------------------------------
-        # 6) Plot LOW basis
+        # 4) Plot MID / HIGH / LOW basis
         # ------------------------------------------------------
-        plt.figure(figsize=(12, 6))
-        for ex in pivot_low.columns:
-            plt.plot(pivot_low.index, pivot_low[ex], label=ex)
-
-        plt.axhline(0.0, color="black", linewidth=1, linestyle="--", alpha=0.7)
-        plt.title(
-            "Futures vs Binance spot: % difference during crash window (LOW)\n"
-            f"{START_TIME_STR} → {END_TIME_STR} (UTC), median across markets"
-        )
-        plt.ylabel("% difference from Binance spot (futures – spot) / spot × 100 (low)")
-        plt.xlabel("Time (UTC)")
-        plt.legend()
-        plt.grid(True)
-        plt.tight_layout()
-        plt.savefig(OUT_PNG_LOW, dpi=150)
-        plt.close()
-        print(f"Wrote median low-basis chart: {OUT_PNG_LOW}")
+        # One Agg-backed Figure, no pyplot figure manager
+        fig = Figure(figsize=(12, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
+
+        for kind, pivot, out_png in (
+            ("mid",  pivot_mid,  OUT_PNG_MID),
+            ("high", pivot_high, OUT_PNG_HIGH),
+            ("low",  pivot_low,  OUT_PNG_LOW),
+        ):
+            plot_basis(ax, pivot, kind, out_png)
+            print(f"Wrote median {kind}-basis chart: {out_png}")
 
     finally:
-        conn_binance.close()
+        binance_pool.closeall()
 
 
 if __name__ == "__main__":